@@ -3,152 +3,926 @@ Simple Azure AI Foundry Agent App
 No Teams SDK, no complexity - just a clean agent interface
 """
 
-from azure.identity import DefaultAzureCredential
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-import requests
-import json
+from azure.identity import AzureCliCredential, ManagedIdentityCredential
+from quart import Quart, Response, request, session
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+import httpcore
+import httpx
+import msgspec
+import asyncio
+import gzip
+import hashlib
+import atexit
+import logging
+import logging.handlers
+import queue
+import orjson
 import os
+import random
+import secrets
+import socket
+import threading
+import time
+from collections import namedtuple
+from contextlib import AsyncExitStack, aclosing
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.request import getproxies, proxy_bypass
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+DEBUG_MODE = os.environ.get('FLASK_ENV') == 'development'
+
+# Application logging: verbose in development, warnings and errors otherwise
+# (override with LOG_LEVEL). Records are queued and written by a background
+# thread so stream I/O never blocks the event loop.
+log = logging.getLogger("agent")
+log.setLevel(os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG_MODE else 'WARNING').upper())
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.propagate = False
+
+# Static assets (including the chat page) are served by Quart's static handler,
+# which supports ETag/Last-Modified conditional requests
+app = Quart(__name__, static_folder='static', static_url_path='')
+# Static files are revalidated via ETag/Last-Modified, not cached for Quart's default 12h
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Quart JSON provider backed by orjson, for anything that goes through app.json"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+app = cors(app)
+
+# Each browser session keeps its own conversation thread in a signed cookie.
+# Set APP_SECRET_KEY so sessions survive restarts and are shared across workers.
+app.secret_key = os.getenv('APP_SECRET_KEY')
+if not app.secret_key:
+    # Only safe with a single process; gunicorn.conf.py sets one key for all its workers
+    log.warning("⚠️ APP_SECRET_KEY is not set; sessions won't be shared across processes or restarts")
+    app.secret_key = secrets.token_hex(32)
+app.config['SESSION_COOKIE_SAMESITE'] = 'None'  # Teams loads the app in an iframe
+app.config['SESSION_COOKIE_SECURE'] = True
+# Forget a session's thread after this long without a chat. Only chats renew the
+# session cookie (see get_thread_id), so other requests such as the page's /health
+# polling neither extend it nor send Set-Cookie on cacheable responses. The
+# signed cookie's timestamp is checked server-side, so an old cookie can't revive a thread.
+THREAD_TTL_SECONDS = int(os.getenv('THREAD_TTL_SECONDS', '3600'))
+app.config['PERMANENT_SESSION_LIFETIME'] = THREAD_TTL_SECONDS
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+# Chat payloads are small; reject anything larger before it is read or parsed
+MAX_REQUEST_BYTES = 16 * 1024
+MAX_MESSAGE_LENGTH = 4000  # characters
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
 # Azure AI Configuration - using the provided endpoint
 ENDPOINT = "https://epwater-multi-agent-test-resourc.services.ai.azure.com/api/projects/multi-agent-test"
 AGENT_ID = os.getenv('AZURE_AI_AGENT_ID', 'your-agent-id')  # Set this in .env
 API_VERSION = "2025-05-01"
 
+# Azure AI URLs, built once per thread rather than on every call
+THREADS_URL = f"{ENDPOINT}/threads?api-version={API_VERSION}"
+THREAD_URL = f"{ENDPOINT}/threads/{{thread_id}}?api-version={API_VERSION}"
+ThreadURLs = namedtuple('ThreadURLs', ['runs', 'run_status', 'run_tool_outputs', 'run_cancel', 'run_messages'])
+
+@lru_cache(maxsize=1024)
+def thread_urls(thread_id):
+    """Return the run/message URLs for a thread; run_id is filled in per run"""
+    base = f"{ENDPOINT}/threads/{thread_id}"
+    return ThreadURLs(
+        runs=f"{base}/runs?api-version={API_VERSION}",
+        run_status=f"{base}/runs/{{run_id}}?api-version={API_VERSION}",
+        run_tool_outputs=f"{base}/runs/{{run_id}}/submit_tool_outputs?api-version={API_VERSION}",
+        run_cancel=f"{base}/runs/{{run_id}}/cancel?api-version={API_VERSION}",
+        run_messages=f"{base}/messages?api-version={API_VERSION}&order=desc&limit=1&run_id={{run_id}}"
+    )
+
+# Token limits per run, to bound response latency
+MAX_OUTPUT_TOKENS = int(os.getenv('AZURE_AI_MAX_OUTPUT_TOKENS', '500'))
+MAX_INPUT_TOKENS = int(os.getenv('AZURE_AI_MAX_INPUT_TOKENS', '4000'))
+
+# Request body pieces that are the same for every call
+CREATE_THREAD_BODY = orjson.dumps({})
+RUN_DEFAULTS = {
+    "assistant_id": AGENT_ID,
+    "max_completion_tokens": MAX_OUTPUT_TOKENS,
+    "max_prompt_tokens": MAX_INPUT_TOKENS
+}
+
 # Azure Authentication
-credential = DefaultAzureCredential()
-current_thread_id = None
+def create_credential():
+    """Pick the one credential that fits where the app runs.
+    
+    DefaultAzureCredential probes several sources in turn on first use;
+    App Service always has a managed identity and local development
+    uses the Azure CLI login, so go straight to the right one.
+    """
+    if os.getenv('WEBSITE_SITE_NAME'):
+        return ManagedIdentityCredential(client_id=os.getenv('AZURE_CLIENT_ID'))
+    return AzureCliCredential()
+
+credential = create_credential()
+
+# API key fallback headers, built once at startup
+API_KEY = os.getenv('AZURE_AI_API_KEY')
+API_KEY_HEADERS = {
+    "api-key": API_KEY,
+    "Content-Type": "application/json"
+} if API_KEY else None
+
+# Reply used when a run finishes without any assistant text
+FALLBACK_REPLY = "Sorry, I couldn't process your request at the moment."
+
+# Shared HTTP/2 client for all Azure AI calls, opened when the server starts
+http_client = None
+
+# Connection pool and retry policy for the shared client
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE = 32
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds
+HTTP_MAX_RETRIES = 2
+HTTP_BACKOFF_FACTOR = 0.2
+HTTP_RETRY_STATUSES = {429, 502, 503, 504}
+# Longer Retry-After hints are handed back to the caller instead of slept on
+HTTP_MAX_RETRY_AFTER = 5
+
+# Resolved addresses for the Azure endpoint, reused for new connections
+ENDPOINT_HOST = urlparse(ENDPOINT).hostname
+DNS_CACHE_TTL = 300  # seconds
 
-def get_auth_headers():
-    """Get authorization headers for Azure AI API"""
+class PinnedDNSBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that resolves pinned hosts once and connects to the cached IPs.
+    
+    Only the TCP connect uses the IP; TLS still runs against the original
+    host name, so SNI and certificate checks are unaffected.
+    """
+    
+    def __init__(self, hosts, ttl=DNS_CACHE_TTL):
+        self._backend = httpcore.AnyIOBackend()
+        self._hosts = set(hosts)
+        self._ttl = ttl
+        self._cache = {}  # (host, port) -> (expires_at, [ip, ...])
+    
+    async def resolve(self, host, port, timeout=None):
+        """Return the cached addresses for host, resolving them if missing or stale.
+        
+        Resolution failures are raised as httpcore.ConnectError/ConnectTimeout,
+        as the default backend does, so httpx maps them to its own exceptions.
+        """
+        cached = self._cache.get((host, port))
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(host, port, proto=socket.IPPROTO_TCP),
+                timeout
+            )
+        except asyncio.TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"Timed out resolving {host}") from e
+        except OSError as e:
+            raise httpcore.ConnectError(f"Could not resolve {host}: {e}") from e
+        ips = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[(host, port)] = (time.monotonic() + self._ttl, ips)
+        return ips
+    
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if host not in self._hosts:
+            return await self._backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        ips = await self.resolve(host, port, timeout)
+        for ip in ips:
+            try:
+                return await self._backend.connect_tcp(ip, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if ip == ips[-1]:
+                    # Every cached address failed; resolve again on the next attempt
+                    self._cache.pop((host, port), None)
+                    raise
+    
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+    
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+def _endpoint_proxy():
+    """Return the proxy the environment (HTTPS_PROXY, NO_PROXY...) sets for the endpoint, or None"""
+    if proxy_bypass(ENDPOINT_HOST):
+        return None
+    proxies = getproxies()
+    return proxies.get('https') or proxies.get('all')
+
+@app.before_serving
+async def open_http_client():
+    """Create the shared httpx client on the server's event loop"""
+    global http_client
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    proxy = _endpoint_proxy()
+    if proxy:
+        # Behind a proxy, the proxy resolves the endpoint, so there is nothing to
+        # pin. Leave transport selection to httpx so it routes through the proxy.
+        log.info("Using proxy %s for %s; DNS pinning disabled", proxy, ENDPOINT_HOST)
+        http_client = httpx.AsyncClient(http2=True, limits=limits, timeout=30)
+        return
+    
+    # An explicit transport makes httpx ignore proxy settings from the environment,
+    # which is only safe because none applies to the endpoint (checked above).
+    # httpx has no public option for the network backend, so set it on the pool;
+    # httpcore is pinned in requirements.txt for this.
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits)
+    dns_backend = PinnedDNSBackend([ENDPOINT_HOST])
+    transport._pool._network_backend = dns_backend
     try:
-        print("🔐 Attempting Azure authentication...")
-        token = credential.get_token("https://ai.azure.com/.default").token
-        print("✅ Azure token obtained successfully")
-        return {
-            "Authorization": f"Bearer {token}",
+        await dns_backend.resolve(ENDPOINT_HOST, 443)
+    except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+        log.warning("⚠️ Could not pre-resolve %s: %s", ENDPOINT_HOST, e)
+    http_client = httpx.AsyncClient(transport=transport, timeout=30)
+
+@app.after_serving
+async def close_http_client():
+    """Close the shared httpx client on shutdown"""
+    if http_client is not None:
+        # Spare threads are deleted while the client can still reach Azure
+        await discard_warm_threads()
+        await http_client.aclose()
+
+# Cached AAD token, refreshed shortly before it expires
+TOKEN_SCOPE = "https://ai.azure.com/.default"
+TOKEN_REFRESH_MARGIN = 300  # seconds
+CREDENTIAL_RETRY_INTERVAL = 300  # seconds to stay on the API key after a credential failure
+_token_cache = {"token": None, "exp": 0, "headers": None, "retry_at": 0}
+_token_lock = threading.Lock()
+
+def _cached_bearer():
+    """Return the cached bearer token if it is still fresh, else None"""
+    if _token_cache["token"] and time.time() < _token_cache["exp"] - TOKEN_REFRESH_MARGIN:
+        return _token_cache["token"]
+    return None
+
+def _get_bearer():
+    """Return a cached bearer token, fetching a new one only when close to expiry"""
+    token = _cached_bearer()
+    if token:
+        return token
+    with _token_lock:
+        # Another thread may have refreshed while we waited for the lock
+        token = _cached_bearer()
+        if token:
+            return token
+        log.debug("🔐 Attempting Azure authentication...")
+        access_token = credential.get_token(TOKEN_SCOPE)
+        _token_cache["headers"] = {
+            "Authorization": f"Bearer {access_token.token}",
             "Content-Type": "application/json"
         }
+        _token_cache["token"] = access_token.token
+        _token_cache["exp"] = access_token.expires_on
+        log.debug("✅ Azure token obtained successfully")
+        return access_token.token
+
+async def get_auth_headers():
+    """Get authorization headers for Azure AI API (shared dict, do not mutate)"""
+    # After a credential failure, don't pay for the credential chain on every call
+    if API_KEY_HEADERS and time.time() < _token_cache["retry_at"]:
+        return API_KEY_HEADERS
+    
+    try:
+        # The credential is blocking, so only refresh off the event loop
+        if not _cached_bearer():
+            await asyncio.to_thread(_get_bearer)
+        return _token_cache["headers"]
     except Exception as e:
-        print(f"❌ Azure authentication error: {e}")
-        print(f"❌ Exception type: {type(e).__name__}")
+        log.error("❌ Azure authentication error (%s): %s", type(e).__name__, e)
         
         # Fallback to API key if available
-        api_key = os.getenv('AZURE_AI_API_KEY')
-        if api_key:
-            print("🔑 Using API key fallback")
-            return {
-                "api-key": api_key,
-                "Content-Type": "application/json"
-            }
+        if API_KEY_HEADERS:
+            log.warning("🔑 Using API key fallback for the next %s seconds", CREDENTIAL_RETRY_INTERVAL)
+            _token_cache["retry_at"] = time.time() + CREDENTIAL_RETRY_INTERVAL
+            return API_KEY_HEADERS
         else:
-            print("💥 No API key found in environment. Please set AZURE_AI_API_KEY or configure Azure authentication.")
+            log.error("💥 No API key found in environment. Please set AZURE_AI_API_KEY or configure Azure authentication.")
             raise
 
-def create_thread():
+# Longest a run may take end to end, streamed or polled, tool calls included
+RUN_TIMEOUT = 45  # seconds
+
+# Run status polling: exponential backoff with jitter, bounded by RUN_TIMEOUT
+POLL_INITIAL_DELAY = 0.2  # seconds
+POLL_MAX_DELAY = 2.0
+POLL_BACKOFF = 2
+
+def _retry_after_seconds(response):
+    """Parse a Retry-After header (delta-seconds or HTTP-date), or None if absent/invalid"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+async def azure_request(method, url, **kwargs):
+    """Issue a request on the shared client, retrying throttling and gateway errors"""
+    return await azure_send(http_client.build_request(method, url, **kwargs))
+
+async def azure_send(request, stream=False):
+    """Send a prebuilt request, retrying throttling and gateway errors.
+    
+    Reusing one built request (as the status poll does) skips URL parsing
+    and header merging on every call. With stream=True the body is left
+    unread and the caller must aclose() the response.
+    """
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        delay = HTTP_BACKOFF_FACTOR * (2 ** attempt)
+        try:
+            response = await http_client.send(request, stream=stream)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Nothing reached the server, so retrying is safe for any method
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                return response
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None:
+                if retry_after > HTTP_MAX_RETRY_AFTER:
+                    return response
+                delay = retry_after
+            await response.aclose()
+        await asyncio.sleep(delay)
+
+async def create_thread():
     """Create a new conversation thread"""
     try:
-        url = f"{ENDPOINT}/threads?api-version={API_VERSION}"
-        print(f"🔗 Creating thread at: {url}")
+        url = THREADS_URL
+        log.debug("🔗 Creating thread at: %s", url)
         
-        headers = get_auth_headers()
-        print(f"🔑 Headers prepared successfully")
+        headers = await get_auth_headers()
+        log.debug("🔑 Headers prepared successfully")
         
-        response = requests.post(url, headers=headers, json={})
-        print(f"📡 Response status: {response.status_code}")
-        print(f"📄 Response text: {response.text}")
+        response = await azure_request('POST', url, headers=headers, content=CREATE_THREAD_BODY)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("📡 Response status: %s", response.status_code)
+            log.debug("📄 Response text: %s", response.text)
         
         if response.status_code in [200, 201]:
-            thread_data = response.json()
+            thread_data = orjson.loads(response.content)
             thread_id = thread_data['id']
-            print(f"✅ Thread created successfully: {thread_id}")
+            log.debug("✅ Thread created successfully: %s", thread_id)
             return thread_id
         else:
-            print(f"❌ Error creating thread. Status: {response.status_code}")
-            print(f"❌ Response: {response.text}")
+            log.error("❌ Error creating thread. Status: %s, response: %s", response.status_code, response.text)
             return None
     except Exception as e:
-        print(f"💥 Exception in create_thread: {str(e)}")
-        print(f"💥 Exception type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
+        log.exception("💥 Exception in create_thread (%s): %s", type(e).__name__, e)
         return None
 
-def send_message(thread_id, message):
-    """Send a message to the agent"""
-    # Add message to thread
-    url = f"{ENDPOINT}/threads/{thread_id}/messages?api-version={API_VERSION}"
-    headers = get_auth_headers()
+# Spare threads created ahead of time so a new conversation doesn't wait on one.
+# The pool is per worker, so it only fills once the worker has handed out a thread.
+WARM_THREADS = int(os.getenv('WARM_THREADS', '1'))
+_warm_threads = []
+_warmup_state = {"task": None, "token": None}
+
+async def _fill_warm_threads():
+    """Create spare threads until the warm pool is full"""
+    while len(_warm_threads) < WARM_THREADS:
+        thread_id = await create_thread()
+        if not thread_id:
+            return
+        _warm_threads.append(thread_id)
+
+def _schedule_warm_threads():
+    """Refill the warm pool in the background, unless a refill is already running"""
+    task = _warmup_state["task"]
+    if WARM_THREADS > 0 and (task is None or task.done()):
+        _warmup_state["task"] = asyncio.create_task(_fill_warm_threads())
+
+async def _warm_token():
+    """Fetch the first token so the first chat doesn't wait on the credential"""
+    try:
+        await get_auth_headers()
+    except Exception as e:
+        log.warning("⚠️ Could not fetch a token at startup: %s", e)
+
+@app.before_serving
+async def warm_up():
+    """Fetch the first token without delaying startup"""
+    _warmup_state["token"] = asyncio.create_task(_warm_token())
+
+async def discard_warm_threads():
+    """Stop any background warm-up and delete spare threads nobody was given"""
+    for task in _warmup_state.values():
+        if task is not None:
+            task.cancel()
+    spares = _warm_threads[:]
+    _warm_threads.clear()
+    if not spares:
+        return
+    try:
+        headers = await get_auth_headers()
+        await asyncio.gather(
+            *(http_client.delete(THREAD_URL.format(thread_id=thread_id), headers=headers) for thread_id in spares),
+            return_exceptions=True
+        )
+    except Exception as e:
+        log.warning("⚠️ Could not delete spare threads: %s", e)
+
+async def get_thread_id():
+    """Return the caller's conversation thread, creating one on first use.
     
-    message_data = {
-        "role": "user",
-        "content": message
-    }
+    Each chat renews the session; a thread left idle for longer than
+    THREAD_TTL_SECONDS is dropped and a new one started.
+    """
+    now = int(time.time())
+    thread_id = session.get('thread_id')
+    if thread_id and now - session.get('last_chat', 0) > THREAD_TTL_SECONDS:
+        thread_id = None
+    if not thread_id:
+        if _warm_threads:
+            thread_id = _warm_threads.pop()
+        else:
+            thread_id = await create_thread()
+        _schedule_warm_threads()
+        if thread_id:
+            session.permanent = True
+            session['thread_id'] = thread_id
+    if thread_id:
+        session['last_chat'] = now
+    return thread_id
+
+async def _iter_sse(response):
+    """Yield (event, data) pairs from a server-sent event stream"""
+    event, data_lines = None, []
+    async for line in response.aiter_lines():
+        if not line:
+            if data_lines:
+                yield event, "\n".join(data_lines)
+            event, data_lines = None, []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        yield event, "\n".join(data_lines)
+
+# Typed views of the service payloads. Run events carry the whole run object
+# (instructions, tool definitions, usage...); decoding into these structs
+# validates only the fields read here and skips the rest without building dicts.
+# Every field is optional and nullable, as lenient as the dict lookups they replace.
+class TextValue(msgspec.Struct):
+    value: str | None = None
+
+class ContentBlock(msgspec.Struct):
+    text: TextValue | str | None = None
+    value: str | None = None
+
+class Message(msgspec.Struct):
+    role: str | None = None
+    content: list[ContentBlock] | None = None
+
+class MessageDelta(msgspec.Struct):
+    content: list[ContentBlock] | None = None
+
+class MessageDeltaEvent(msgspec.Struct):
+    delta: MessageDelta | None = None
+
+class MessageList(msgspec.Struct):
+    data: list[Message] | None = None
+
+class Run(msgspec.Struct):
+    id: str | None = None
+    status: str | None = None
+    required_action: dict | None = None
+    incomplete_details: dict | None = None
+
+decode_run = msgspec.json.Decoder(Run).decode
+decode_message = msgspec.json.Decoder(Message).decode
+decode_message_delta = msgspec.json.Decoder(MessageDeltaEvent).decode
+decode_message_list = msgspec.json.Decoder(MessageList).decode
+
+def _block_text(block):
+    """Return the text of one content block ({'text': {'value'}} or {'value'}), or None"""
+    text = block.text
+    if isinstance(text, TextValue) and text.value:
+        return text.value
+    if isinstance(text, str) and text:
+        return text
+    return block.value or None
+
+def _message_text(message):
+    """Return the text of a message's first non-empty content block, or None"""
+    for block in message.content or ():
+        text = _block_text(block)
+        if text:
+            return text
+    return None
+
+# Local function tools the agent may call, by name. Each handler takes the
+# tool's arguments as keyword arguments and returns a string or JSON-able value.
+TOOL_HANDLERS = {}
+
+async def _run_tool_call(tool_call):
+    """Execute one function tool call and return its tool output entry"""
+    name = tool_call.get('function', {}).get('name')
+    handler = TOOL_HANDLERS.get(name)
+    if handler is None:
+        output = f"Tool '{name}' is not available"
+    else:
+        try:
+            arguments = orjson.loads(tool_call['function'].get('arguments') or '{}')
+            # Handlers may block, so keep them off the event loop
+            result = await asyncio.to_thread(handler, **arguments)
+            output = result if isinstance(result, str) else orjson.dumps(result).decode()
+        except Exception as e:
+            log.exception("Tool %s failed", name)
+            output = f"Tool '{name}' failed: {e}"
+    return {"tool_call_id": tool_call['id'], "output": output}
+
+async def _run_tool_calls(run):
+    """Execute all tool calls a run is waiting on, concurrently"""
+    tool_calls = (run.required_action or {}).get('submit_tool_outputs', {}).get('tool_calls') or []
+    return await asyncio.gather(*(_run_tool_call(tool_call) for tool_call in tool_calls))
+
+async def _cancel_run(urls, run_id, headers):
+    """Cancel a run that outlived RUN_TIMEOUT, so it doesn't keep the thread busy"""
+    try:
+        response = await http_client.post(urls.run_cancel.format(run_id=run_id), headers=headers, timeout=5)
+        if response.status_code not in [200, 201]:
+            log.warning("Could not cancel run %s: %s", run_id, response.text)
+    except httpx.HTTPError as e:
+        log.warning("Could not cancel run %s: %s", run_id, e)
+
+# Background tasks following streamed runs after their caller has the reply
+_run_followers = set()
+
+async def _follow_stream(response, urls, headers, events):
+    """Read an Azure streaming run until it settles, putting run events on a queue.
     
-    response = requests.post(url, headers=headers, json=message_data)
-    if response.status_code not in [200, 201]:
-        print(f"Error adding message: {response.text}")
-        return None
+    Runs as its own task so the run is seen through to the end, tool calls
+    included, even after the caller has its reply and stops listening; a
+    run left waiting on tool outputs would keep the thread busy and fail
+    the next message. When the run stops for tool outputs, they are
+    submitted and the resumed run's stream is read the same way. A run
+    still going after RUN_TIMEOUT is cancelled. The queue ends with None.
+    """
+    run_id = None
+    try:
+        async with asyncio.timeout(RUN_TIMEOUT), AsyncExitStack() as streams:
+            streams.push_async_callback(response.aclose)
+            while response is not None:
+                waiting_run = None
+                async for event, data in _iter_sse(response):
+                    if data == '[DONE]':
+                        break
+                    
+                    try:
+                        if event == 'thread.message.delta':
+                            delta = decode_message_delta(data).delta
+                        elif event in ['thread.message.completed', 'thread.message.incomplete']:
+                            message = decode_message(data)
+                        elif event and event.startswith('thread.run.') and not event.startswith('thread.run.step.'):
+                            run = decode_run(data)
+                    except msgspec.DecodeError as e:
+                        # One odd event shouldn't fail the whole chat
+                        log.warning("Skipping malformed %s event: %s", event, e)
+                        continue
+                    
+                    if event == 'thread.message.delta':
+                        for block in (delta.content if delta else None) or ():
+                            text = _block_text(block)
+                            if text:
+                                events.put_nowait({'delta': text})
+                    elif event in ['thread.message.completed', 'thread.message.incomplete']:
+                        if message.role == 'assistant':
+                            events.put_nowait({'message': _message_text(message)})
+                    elif event and event.startswith('thread.run.') and not event.startswith('thread.run.step.'):
+                        run_id = run.id or run_id
+                        status = run.status
+                        if status:
+                            events.put_nowait({'status': status})
+                        if status == 'requires_action':
+                            waiting_run = run
+                        elif status == 'incomplete':
+                            # Stopped early, e.g. at max_completion_tokens; keep the text so far
+                            log.warning("Run incomplete: %s", run.incomplete_details)
+                            break
+                        elif status in ['failed', 'cancelled', 'expired']:
+                            log.warning("Run failed with status: %s", status)
+                            break
+                    elif event == 'error':
+                        log.error("Run stream error: %s", data)
+                        break
+                
+                response = None
+                if waiting_run:
+                    # Resume the run with the tool outputs and keep streaming
+                    tool_outputs = await _run_tool_calls(waiting_run)
+                    tool_outputs_url = urls.run_tool_outputs.format(run_id=waiting_run.id)
+                    body = orjson.dumps({"tool_outputs": tool_outputs, "stream": True})
+                    response = await streams.enter_async_context(
+                        http_client.stream('POST', tool_outputs_url, headers=headers, content=body)
+                    )
+                    if response.status_code not in [200, 201]:
+                        await response.aread()
+                        log.error("Error submitting tool outputs: %s", response.text)
+                        response = None
+    except TimeoutError:
+        log.warning("Run %s timed out after %ss", run_id, RUN_TIMEOUT)
+        events.put_nowait({'timed_out': True})
+        if run_id:
+            await _cancel_run(urls, run_id, headers)
+    except Exception as e:
+        log.exception("Run stream failed (%s): %s", type(e).__name__, e)
+        events.put_nowait({'error': 'Failed to read the run stream'})
+    finally:
+        events.put_nowait(None)
+
+async def _stream_run(response, urls, headers):
+    """Translate an Azure streaming run into run events, accumulating the reply text.
     
-    # Create run
-    run_url = f"{ENDPOINT}/threads/{thread_id}/runs?api-version={API_VERSION}"
-    run_data = {
-        "assistant_id": AGENT_ID
-    }
+    The reply is returned as soon as the assistant message completes,
+    while the run itself is followed to the end in the background. Takes
+    ownership of response and closes it when the run settles.
+    """
+    events = asyncio.Queue()
+    follower = asyncio.create_task(_follow_stream(response, urls, headers, events))
+    _run_followers.add(follower)
+    follower.add_done_callback(_run_followers.discard)
+    
+    parts = []
+    last_status = None
+    while (event := await events.get()) is not None:
+        if 'timed_out' in event:
+            # Don't pass off text cut short mid-run as the answer
+            yield {'response': FALLBACK_REPLY}
+            return
+        if 'message' in event:
+            # The reply is final; no need to wait for the run to wind down
+            content = event['message'] or "".join(parts)
+            if content:
+                yield {'response': content}
+                return
+        elif 'status' in event:
+            if event['status'] != last_status:
+                last_status = event['status']
+                yield event
+        else:
+            if 'delta' in event:
+                parts.append(event['delta'])
+            yield event
+            if 'error' in event:
+                return
     
-    run_response = requests.post(run_url, headers=headers, json=run_data)
+    if parts:
+        yield {'response': "".join(parts)}
+    else:
+        yield {'response': FALLBACK_REPLY}
+
+async def _poll_run(urls, headers, run_data):
+    """Create a run and poll it to completion, yielding run events"""
+    run_response = await azure_request('POST', urls.runs, headers=headers, content=orjson.dumps(run_data))
     if run_response.status_code not in [200, 201]:
-        print(f"Error creating run: {run_response.text}")
-        return None
+        log.error("Error creating run: %s", run_response.text)
+        yield {'error': 'Failed to create run'}
+        return
     
-    run_id = run_response.json()['id']
+    run_id = orjson.loads(run_response.content)['id']
     
     # Poll for completion
-    import time
-    max_attempts = 30
-    for _ in range(max_attempts):
-        status_url = f"{ENDPOINT}/threads/{thread_id}/runs/{run_id}?api-version={API_VERSION}"
-        status_response = requests.get(status_url, headers=headers)
-        
+    status_request = http_client.build_request('GET', urls.run_status.format(run_id=run_id), headers=headers)
+    deadline = time.monotonic() + RUN_TIMEOUT
+    delay = POLL_INITIAL_DELAY
+    last_status = None
+    while time.monotonic() < deadline:
+        status_response = await azure_send(status_request)
+        run = Run()
         if status_response.status_code == 200:
-            status = status_response.json()['status']
-            if status == 'completed':
-                # Get messages
-                messages_url = f"{ENDPOINT}/threads/{thread_id}/messages?api-version={API_VERSION}"
-                messages_response = requests.get(messages_url, headers=headers)
-                
-                if messages_response.status_code == 200:
-                    messages = messages_response.json()['data']
-                    # Return the latest assistant message
-                    for msg in messages:
-                        if msg['role'] == 'assistant':
-                            content = msg['content'][0]['text']['value']
-                            return content
-                break
-            elif status in ['failed', 'cancelled', 'expired']:
-                print(f"Run failed with status: {status}")
+            try:
+                run = decode_run(status_response.content)
+            except msgspec.DecodeError as e:
+                log.warning("Unreadable run status: %s", e)
+        status = run.status
+        
+        if status and status != last_status:
+            last_status = status
+            yield {'status': status}
+        
+        if status in ['completed', 'incomplete']:
+            if status == 'incomplete':
+                # Stopped early, e.g. at max_completion_tokens; the partial reply is still useful
+                log.warning("Run incomplete: %s", run.incomplete_details)
+            # Get only the newest message produced by this run
+            messages_url = urls.run_messages.format(run_id=run_id)
+            messages_response = await azure_request('GET', messages_url, headers=headers)
+            
+            if messages_response.status_code == 200:
+                try:
+                    messages = decode_message_list(messages_response.content).data
+                except msgspec.DecodeError as e:
+                    log.warning("Unreadable run messages: %s", e)
+                    messages = None
+                content = None
+                if messages and messages[0].role == 'assistant':
+                    content = _message_text(messages[0])
+                if content:
+                    yield {'response': content}
+                    return
+            break
+        elif status in ['failed', 'cancelled', 'expired']:
+            log.warning("Run failed with status: %s", status)
+            break
+        elif status == 'requires_action':
+            # Submit the tool outputs and poll the resumed run from the start
+            tool_outputs = await _run_tool_calls(run)
+            tool_outputs_url = urls.run_tool_outputs.format(run_id=run_id)
+            submit_response = await azure_request(
+                'POST', tool_outputs_url, headers=headers,
+                content=orjson.dumps({"tool_outputs": tool_outputs})
+            )
+            if submit_response.status_code not in [200, 201]:
+                log.error("Error submitting tool outputs: %s", submit_response.text)
                 break
+            delay = POLL_INITIAL_DELAY
         
-        time.sleep(1)
+        # Back off with jitter, but never poll sooner than the service's Retry-After asks
+        sleep_for = min(delay, POLL_MAX_DELAY) * random.uniform(0.8, 1.2)
+        retry_after = _retry_after_seconds(status_response)
+        if retry_after is not None:
+            sleep_for = max(sleep_for, retry_after)
+        await asyncio.sleep(max(0.0, min(sleep_for, deadline - time.monotonic())))
+        delay *= POLL_BACKOFF
+    else:
+        log.warning("Run %s timed out after %ss", run_id, RUN_TIMEOUT)
+        await _cancel_run(urls, run_id, headers)
+    
+    yield {'response': FALLBACK_REPLY}
+
+def _streaming_unsupported(response):
+    """Whether a failed run creation rejected the stream option itself.
     
-    return "Sorry, I couldn't process your request at the moment."
+    Only then can the same run be retried by polling; any other 400
+    (e.g. the thread already has an active run) would just fail again.
+    """
+    if response.status_code != 400:
+        return False
+    try:
+        error = orjson.loads(response.content).get('error')
+    except (orjson.JSONDecodeError, AttributeError):
+        return False
+    if not isinstance(error, dict):
+        return False
+    return error.get('param') == 'stream' or 'stream' in (error.get('message') or '').lower()
+
+async def run_agent(thread_id, message):
+    """Send a message to the agent and yield run events as they happen.
+    
+    Yields {'status': ...} on each run status transition and {'delta': ...}
+    for each chunk of generated text, then either {'response': ...} with
+    the full assistant reply or {'error': ...}.
+    """
+    headers = await get_auth_headers()
+    urls = thread_urls(thread_id)
+    
+    # Create run, adding the user message in the same request
+    run_data = {
+        **RUN_DEFAULTS,
+        "additional_messages": [
+            {"role": "user", "content": message}
+        ]
+    }
+    
+    # Stream the run so text arrives as it is generated
+    stream_headers = {**headers, "Accept": "text/event-stream"}
+    stream_body = orjson.dumps({**run_data, "stream": True})
+    stream_request = http_client.build_request('POST', urls.runs, headers=stream_headers, content=stream_body)
+    stream_response = await azure_send(stream_request, stream=True)
+    if stream_response.status_code in [200, 201]:
+        # _stream_run owns the response from here and closes it once the run settles
+        async for event in _stream_run(stream_response, urls, stream_headers):
+            yield event
+        return
+    try:
+        await stream_response.aread()
+    finally:
+        await stream_response.aclose()
+    
+    if not _streaming_unsupported(stream_response):
+        log.error("Error creating run: %s", stream_response.text)
+        yield {'error': 'Failed to create run'}
+        return
+    
+    # Streaming isn't supported here; fall back to polling the run status
+    log.info("Streaming run unavailable: %s", stream_response.text)
+    async for event in _poll_run(urls, headers, run_data):
+        yield event
+
+async def send_message(thread_id, message):
+    """Send a message to the agent and wait for the full reply"""
+    async with aclosing(run_agent(thread_id, message)) as events:
+        async for event in events:
+            if 'error' in event:
+                return None
+            if 'response' in event:
+                return event['response']
+    return None
+
+# Agent runs in flight, keyed by (thread_id, message hash), so that identical
+# concurrent requests (e.g. client retries) share one upstream run
+_inflight = {}
+
+async def send_message_coalesced(thread_id, message):
+    """Send a message, joining an identical request already running on the thread"""
+    key = (thread_id, hashlib.sha1(message.strip().lower().encode()).hexdigest())
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(send_message(thread_id, message))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shield the shared run so one caller disconnecting doesn't cancel it for the others
+    return await asyncio.shield(task)
+
+def _sse(payload):
+    """Format a payload as a single server-sent event"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def json_response(payload):
+    """Build a JSON response, serialized with orjson"""
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+@lru_cache(maxsize=64)
+def _error_body(message):
+    """Serialized {'error': message} body; the same few errors repeat constantly"""
+    return orjson.dumps({'error': message})
+
+def error_response(message):
+    """Build a JSON error response for one of the app's fixed error messages"""
+    return Response(_error_body(message), mimetype='application/json')
+
+# A streamed chat covers run creation plus the run itself, bounded by RUN_TIMEOUT
+CHAT_STREAM_TIMEOUT = RUN_TIMEOUT + 15  # seconds
+
+# Fixed response pieces, built once
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+NEW_CONVERSATION_JSON = orjson.dumps({'message': 'New conversation started'})
 
 @app.route('/')
-def home():
+async def home():
     """Serve the main HR Policy Assistant interface optimized for Teams"""
-    return send_from_directory('.', 'index.html')
+    response = await app.send_static_file('index.html')
+    # Revalidate on every load so a deploy reaches browsers and the Teams
+    # webview right away; unchanged pages still come back as a 304
+    response.cache_control.no_cache = True
+    return response
 
-@app.route('/privacy')
-def privacy():
-    """Privacy policy for Teams compliance"""
-    return """
+# Static compliance pages, encoded and gzipped once at import
+STATIC_PAGE_MAX_AGE = 86400  # seconds
+
+def _static_page(html):
+    """Pre-encode a static HTML page as (plain, gzipped) bodies"""
+    body = html.encode()
+    return body, gzip.compress(body)
+
+def static_page_response(page):
+    """Serve a pre-encoded page, gzipped when the client accepts it"""
+    plain, compressed = page
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(compressed, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(plain, mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_PAGE_MAX_AGE
+    return response
+
+PRIVACY_PAGE = _static_page("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -167,12 +941,9 @@ def privacy():
         <p><strong>Compliance:</strong> This app follows Microsoft Teams app privacy guidelines.</p>
     </body>
     </html>
-    """
+    """)
 
-@app.route('/terms')
-def terms():
-    """Terms of use for Teams compliance"""
-    return """
+TERMS_PAGE = _static_page("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -191,56 +962,141 @@ def terms():
         <p><strong>Technology:</strong> Built with Azure AI Foundry and Microsoft Teams integration.</p>
     </body>
     </html>
+    """)
+
+@app.route('/privacy')
+async def privacy():
+    """Privacy policy for Teams compliance"""
+    return static_page_response(PRIVACY_PAGE)
+
+@app.route('/terms')
+async def terms():
+    """Terms of use for Teams compliance"""
+    return static_page_response(TERMS_PAGE)
+
+async def read_chat_message():
+    """Read the chat message from a JSON request body.
+    
+    Returns (message, None), or (None, error response) when the body is
+    missing, malformed or too large. Requiring a JSON content type keeps
+    cross-site forms from posting into a user's thread.
     """
+    if request.content_length and request.content_length > MAX_REQUEST_BYTES:
+        return None, (error_response('Request too large'), 413)
+    if request.mimetype != 'application/json':
+        return None, (error_response('Expected a JSON body'), 415)
+    
+    try:
+        # A chunked body has no Content-Length; MAX_CONTENT_LENGTH stops it while reading
+        body = await request.get_data(cache=False)
+    except RequestEntityTooLarge:
+        return None, (error_response('Request too large'), 413)
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None, (error_response('Invalid JSON'), 400)
+    message = data.get('message') if isinstance(data, dict) else None
+    
+    if message is not None and not isinstance(message, str):
+        return None, (error_response('Message must be a string'), 400)
+    if not message or not message.strip():
+        return None, (error_response('No message provided'), 400)
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return None, (error_response('Message too long'), 400)
+    return message, None
 
 @app.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     """Handle chat messages"""
-    global current_thread_id
-    
     try:
-        data = request.get_json()
-        message = data.get('message', '')
-        
-        if not message:
-            return jsonify({'error': 'No message provided'}), 400
+        message, error = await read_chat_message()
+        if error:
+            return error
         
         # Create thread if it doesn't exist
-        if not current_thread_id:
-            current_thread_id = create_thread()
-            if not current_thread_id:
-                return jsonify({'error': 'Failed to create conversation thread'}), 500
+        thread_id = await get_thread_id()
+        if not thread_id:
+            return error_response('Failed to create conversation thread'), 500
         
         # Send message and get response
-        response = send_message(current_thread_id, message)
+        response = await send_message_coalesced(thread_id, message)
         
         if response:
-            return jsonify({
+            return json_response({
                 'response': response,
-                'thread_id': current_thread_id
+                'thread_id': thread_id
             })
         else:
-            return jsonify({'error': 'Failed to get response from agent'}), 500
+            return error_response('Failed to get response from agent'), 500
             
     except Exception as e:
-        print(f"Chat error: {e}")
-        return jsonify({'error': str(e)}), 500
+        log.error("Chat error: %s", e)
+        return json_response({'error': str(e)}), 500
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Handle a chat message, streaming run status and the reply as server-sent events.
+    
+    The message comes in a JSON body, as for /chat, so it stays out of
+    access logs and can't be sent by a cross-site GET.
+    """
+    message, error = await read_chat_message()
+    if error:
+        return error
+    
+    # Resolve the thread before streaming starts so the session cookie can still be set
+    try:
+        thread_id = await get_thread_id()
+    except Exception as e:
+        log.error("Chat stream error: %s", e)
+        thread_id = None
+    
+    async def generate():
+        if not thread_id:
+            yield _sse({'error': 'Failed to create conversation thread'})
+            return
+        deadline = asyncio.get_running_loop().time() + CHAT_STREAM_TIMEOUT
+        try:
+            async with aclosing(run_agent(thread_id, message)) as events:
+                while True:
+                    # Bound only the wait for the next event, not the write to the client
+                    async with asyncio.timeout_at(deadline):
+                        event = await anext(events, None)
+                    if event is None:
+                        break
+                    if 'response' in event:
+                        event['thread_id'] = thread_id
+                    yield _sse(event)
+        except TimeoutError:
+            log.warning("Chat stream timed out after %ss", CHAT_STREAM_TIMEOUT)
+            yield _sse({'error': 'The assistant took too long to respond'})
+        except Exception as e:
+            log.error("Chat stream error: %s", e)
+            yield _sse({'error': str(e)})
+    
+    response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # Outlast the stream's own deadline so the client always gets a final event
+    # rather than Quart's RESPONSE_TIMEOUT silently cutting the stream off
+    response.timeout = CHAT_STREAM_TIMEOUT + 5
+    return response
 
 @app.route('/new-conversation', methods=['POST'])
-def new_conversation():
+async def new_conversation():
     """Start a new conversation"""
-    global current_thread_id
-    current_thread_id = None
-    return jsonify({'message': 'New conversation started'})
+    session.pop('thread_id', None)
+    return Response(NEW_CONVERSATION_JSON, mimetype='application/json')
+
+# Health payload never changes at runtime, so serialize it once
+HEALTH_JSON = orjson.dumps({
+    'status': 'healthy',
+    'endpoint': ENDPOINT,
+    'api_version': API_VERSION
+})
 
 @app.route('/health')
-def health():
+async def health():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'endpoint': ENDPOINT,
-        'api_version': API_VERSION
-    })
+    return Response(HEALTH_JSON, mimetype='application/json')
 
 if __name__ == '__main__':
     print(f"🚀 Starting Simple AI Agent App")
@@ -250,9 +1106,13 @@ if __name__ == '__main__':
     
     # Get port from environment variable (Azure App Service uses this)
     port = int(os.environ.get('PORT', 5000))
-    debug_mode = os.environ.get('FLASK_ENV') == 'development'
+    if not DEBUG_MODE:
+        # The built-in server is for local development only
+        print("⚠️ Set FLASK_ENV=development to use the development server.")
+        print("⚠️ In production start the app with: gunicorn app:app")
+        raise SystemExit(1)
     
     print(f"🌐 Server will run on port: {port}")
     print("=" * 50)
-    app.run(debug=debug_mode, host='0.0.0.0', port=port)
+    app.run(debug=DEBUG_MODE, host='0.0.0.0', port=port)
 
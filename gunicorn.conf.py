@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for production
+Picked up automatically when starting the app with:  gunicorn app:app
+"""
+
+import multiprocessing
+import os
+import secrets
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Quart is an ASGI app, so each worker runs an asyncio event loop via uvicorn
+# (httptools parser, uvloop where available) and can serve many in-flight
+# /chat requests concurrently. Chats are I/O-bound, so one worker per core.
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Session cookies must verify in every worker; without APP_SECRET_KEY, generate
+# one key here in the master so all forked workers inherit the same value
+os.environ.setdefault('APP_SECRET_KEY', secrets.token_hex(32))
+
+# Azure App Service provides the port in PORT
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+# Worker heartbeat: a UvicornWorker silent for this long is restarted. It doesn't
+# limit request or stream duration; app.py bounds runs with RUN_TIMEOUT.
+timeout = 120
+graceful_timeout = 30
+keepalive = 75